@@ -29,10 +29,13 @@ class BranchSimple:
         self.exons = None
 
         self.transfrag_filename = transfrag_filename
-        if is_fq:
-            self.transfrag_len_dict = dict((r.name.split()[0], len(r.sequence)) for r in FastqReader(transfrag_filename))
-        else:
-            self.transfrag_len_dict = dict((r.name.split()[0], len(r.sequence)) for r in FastaReader(transfrag_filename))
+        # also confirms all IDs are unique, so callers don't need a separate pass
+        self.transfrag_len_dict = {}
+        for r in (FastqReader if is_fq else FastaReader)(transfrag_filename):
+            rid = r.name.split()[0]
+            if rid in self.transfrag_len_dict:
+                raise Exception, "Duplicate id {0} detected. Abort!".format(rid)
+            self.transfrag_len_dict[rid] = len(r.sequence)
 
         self.cov_threshold = cov_threshold # only output GTF records if >= this many GMAP records support it (this must be if I'm running non-clustered fasta on GMAP)
 
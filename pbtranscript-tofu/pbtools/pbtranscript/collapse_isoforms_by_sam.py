@@ -37,7 +37,6 @@ __author__ = 'etseng@pacificbiosciences.com'
 # SUCH DAMAGE.
 #################################################################################$$
 import os, sys
-from pbtools.pbtranscript.Utils import check_ids_unique
 from pbtools.pbtranscript.io.SeqReaders import LazyFastaReader, LazyFastqReader
 from pbtools.pbtranscript.branch import branch_simple2
 from pbcore.io.FastaIO import FastaWriter
@@ -104,14 +103,13 @@ def main(args):
         print >> sys.stderr, "SAM file {0} does not exist. Abort.".format(args.sam)
         sys.exit(-1)
 
-    # check for duplicate IDs
-    check_ids_unique(args.input, is_fq=args.fq)
-    
+    # BranchSimple also checks for duplicate IDs while reading the input
+    b = branch_simple2.BranchSimple(args.input, cov_threshold=1, min_aln_coverage=args.min_aln_coverage, min_aln_identity=args.min_aln_identity, is_fq=args.fq)
+
     ignored_fout = open(args.prefix + '.ignored_ids.txt', 'w')
     f_gff = open(args.prefix + '.collapsed.gff', 'w')
     f_txt = open(args.prefix + '.collapsed.group.txt', 'w')
     
-    b = branch_simple2.BranchSimple(args.input, cov_threshold=1, min_aln_coverage=args.min_aln_coverage, min_aln_identity=args.min_aln_identity, is_fq=args.fq)
     iter = b.iter_gmap_sam(args.sam, ignored_fout)
     for recs in iter:
         for v in recs.itervalues():
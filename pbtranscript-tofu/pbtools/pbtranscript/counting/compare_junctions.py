@@ -12,13 +12,15 @@ def compare_junctions(r1, r2):
     partial
     nomatch
     """
+    segs1, segs2 = r1.segments, r2.segments
+    n1, n2 = len(segs1), len(segs2)
     found_overlap = False
     # super/partial --- i > 0, j = 0
     # exact/partial --- i = 0, j = 0
     # subset/partial --- i = 0, j > 0
-    for i,x in enumerate(r1.segments):
+    for i,x in enumerate(segs1):
         # find the first matching r2, which could be further downstream
-        for j,y in enumerate(r2.segments):
+        for j,y in enumerate(segs2):
             if i > 0 and j > 0: break
             if overlaps(x, y) > 0:
                 found_overlap = True
@@ -28,25 +30,24 @@ def compare_junctions(r1, r2):
     if not found_overlap: return "nomatch"
     # now we have r1[i] matched to r2[j]
     # if just one exon, then regardless of how much overlap there is, just call it exact
-    if len(r1.segments) == 1:
-        if len(r2.segments) == 1: return "exact"
+    if n1 == 1:
+        if n2 == 1: return "exact"
         else:
-            if r1.segments[0].end <= r2.segments[j].end:
+            if segs1[0].end <= segs2[j].end:
                 return "subset"
             else:
                 return "partial"
     else:
-        if len(r2.segments) == 1: return "super"
+        if n2 == 1: return "super"
         else: # both r1 and r2 are multi-exon, check that all remaining junctions agree
             k = 0
-            while i+k+1 < len(r1.segments) and j+k+1 < len(r2.segments):
-                if r1.segments[i+k].end!=r2.segments[j+k].end or \
-                   r1.segments[i+k+1].start!=r2.segments[j+k+1].start:
+            while i+k+1 < n1 and j+k+1 < n2:
+                if segs1[i+k].end!=segs2[j+k].end or \
+                   segs1[i+k+1].start!=segs2[j+k+1].start:
                     return "partial"
                 k += 1
-            print i, j, k
-            if i+k+1 == len(r1.segments):
-                if j+k+1 == len(r2.segments): 
+            if i+k+1 == n1:
+                if j+k+1 == n2: 
                     if i == 0:
                         if j == 0: return "exact"
                         else: return "subset"    # j > 0
@@ -54,17 +55,16 @@ def compare_junctions(r1, r2):
                 else: # r1 is at end, r2 not at end
                     if i == 0: return "subset"
                     else:  # i > 0
-                        if r1.segments[i+k-1].end!=r2.segments[j+k-1].end or \
-                           r1.segments[i+k].start!=r2.segments[j+k].start:
+                        if segs1[i+k-1].end!=segs2[j+k-1].end or \
+                           segs1[i+k].start!=segs2[j+k].start:
                             return "partial"
                         else: 
                             return "concordant"
             else: # r1 not at end, r2 must be at end
                 if j == 0: return "super"
                 else:
-                    if r1.segments[i+k-1].end!=r2.segments[j+k-1].end or \
-                        r1.segments[i+k].start!=r2.segments[j+k].start:
+                    if segs1[i+k-1].end!=segs2[j+k-1].end or \
+                        segs1[i+k].start!=segs2[j+k].start:
                         return "partial"
                     else:
                         return "concordant"
-
@@ -182,7 +182,7 @@ def output_read_count_nFL(cid_info, pickle_prefix_list, output_filename, output_
         raise Exception, "Output mode {0} not valid!".format(output_mode)
 
     for sample_prefix, pickle_filename in pickle_prefix_list:
-        with open(pickle_filename) as h:
+        with open(pickle_filename, 'rb') as h:
             result = load(h)
             uc = result['partial_uc']
             if restricted_movies is None:
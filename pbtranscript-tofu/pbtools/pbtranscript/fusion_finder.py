@@ -1,21 +1,42 @@
 #!/usr/bin/env python
 import os, sys
-import itertools
+import numpy as np
 from cPickle import *
-from collections import defaultdict, namedtuple
-from pbtools.pbtranscript.Utils import check_ids_unique
 import pbtools.pbtranscript.tofu_wrap as tofu_wrap
 import pbtools.pbtranscript.BioReaders as BioReaders
 import pbtools.pbtranscript.branch.branch_simple2 as branch_simple2
 import pbtools.pbtranscript.counting.compare_junctions as compare_junctions
 
-from bx.intervals.cluster import ClusterTree
+OUTPUT_BUFFER_SIZE = 1 << 20 # 1 MiB
 
 def sep_by_strand(records):
-    output = {'+':[], '-':[]}
+    """
+    Return (plus_records, minus_records)
+    Records must have _strand set, see iter_gmap_sam_for_fusion()
+    """
+    plus, minus = [], []
     for r in records:
-        output[r.flag.strand].append(r)
-    return output
+        (plus if r._strand == '+' else minus).append(r)
+    return plus, minus
+
+def fusion_compat_info(r):
+    """
+    Helper function for: is_fusion_compatible()
+
+    Return (and cache on the record) the per-record values used for
+    fusion compatibility checks, so the pairwise check does not
+    repeat the attribute lookups for every pair:
+    (strand, qStart, sStart, sEnd, num_segments,
+     first segment start, first segment end,
+     last segment start, last segment end)
+    """
+    try:
+        return r._fc_info
+    except AttributeError:
+        segs = r.segments
+        r._fc_info = (r.flag.strand, r.qStart, r.sStart, r.sEnd, len(segs), \
+                      segs[0].start, segs[0].end, segs[-1].start, segs[-1].end)
+        return r._fc_info
 
 def is_fusion_compatible(r1, r2, max_fusion_point_dist, allow_extra_5_exons):
     """
@@ -29,26 +50,28 @@ def is_fusion_compatible(r1, r2, max_fusion_point_dist, allow_extra_5_exons):
         if allow_extra_5_exons is True, only allow additional 5' exons
     """
     MAX_QSTART_FOR_5 = 100
+    strand1, qStart1, sStart1, sEnd1, n1, first_s1, first_e1, last_s1, last_e1 = fusion_compat_info(r1)
+    strand2, qStart2, sStart2, sEnd2, n2, first_s2, first_e2, last_s2, last_e2 = fusion_compat_info(r2)
     # first need to figure out ends
     # also check that both are in the 5' portion of r1 and r2
-    assert r1.flag.strand == r2.flag.strand
-    if r1.qStart < MAX_QSTART_FOR_5: # in the 5' portion of r1
-        if r2.qStart > MAX_QSTART_FOR_5: # in the 3' portion, reject
+    assert strand1 == strand2
+    if qStart1 < MAX_QSTART_FOR_5: # in the 5' portion of r1
+        if qStart2 > MAX_QSTART_FOR_5: # in the 3' portion, reject
             return False
         in_5_portion = True
     else: # in the 3' portion of r1
-        if r2.qStart < MAX_QSTART_FOR_5: 
+        if qStart2 < MAX_QSTART_FOR_5:
             return False
         in_5_portion = False
-    plus_is_5end = (r1.flag.strand == '+')
+    plus_is_5end = (strand1 == '+')
 
     type = compare_junctions.compare_junctions(r1, r2)
     if type == 'exact':
-        if len(r1.segments) == 1:
-            if len(r2.segments) == 1:
+        if n1 == 1:
+            if n2 == 1:
                 # single exon case, check fusion point is close enough
-                if in_5_portion and plus_is_5end: dist = abs(r1.sStart - r2.sStart)
-                else: dist = abs(r1.sEnd - r2.sEnd)
+                if in_5_portion and plus_is_5end: dist = abs(sStart1 - sStart2)
+                else: dist = abs(sEnd1 - sEnd2)
                 return dist <= max_fusion_point_dist
             else:
                 raise Exception, "Not possible case for multi-exon transcript and " + \
@@ -60,11 +83,11 @@ def is_fusion_compatible(r1, r2, max_fusion_point_dist, allow_extra_5_exons):
             # check that the 3' junction is identical
             # also check that the 3' end is relatively close
             if in_5_portion and plus_is_5end:
-                if r1.segments[-1].start != r2.segments[-1].start: return False
-                if abs(r1.segments[-1].end - r2.segments[-1].end) > max_fusion_point_dist: return False
+                if last_s1 != last_s2: return False
+                if abs(last_e1 - last_e2) > max_fusion_point_dist: return False
             elif in_5_portion and (not plus_is_5end):
-                if r1.segments[0].end != r2.segments[0].end: return False
-                if abs(r1.segments[0].start - r2.segments[0].start) > max_fusion_point_dist: return False
+                if first_e1 != first_e2: return False
+                if abs(first_s1 - first_s2) > max_fusion_point_dist: return False
             else:
                 return False
         else: # not OK because number of exons must be the same
@@ -85,41 +108,61 @@ def merge_fusion_exons(records, max_fusion_point_dist, allow_extra_5_exons):
 
     Returns a list of grouped records, ex: [[r1,r2], [r3], [r4, r5, r6]]....
     which can be sent to BranchSimple.process_records for writing out
+
+    Records must be sorted by sStart (as they come from iter_gmap_sam_for_fusion)
     """
     output = [[records[0]]]
+    # r1 is only compatible with a group if it overlaps every record in it,
+    # so keep per group [max sStart, min sEnd] of its records
+    bounds = [[records[0].sStart, records[0].sEnd]]
+    active = [0]
     for r1 in records[1:]:
+        # a group that ends before r1 starts can't take r1 or any later record
+        active = [i for i in active if bounds[i][1] > r1.sStart]
         merged = False
         # go through output, seeing if mergeable
-        for i, r2s in enumerate(output):
-            if all(is_fusion_compatible(r1, r2, max_fusion_point_dist, allow_extra_5_exons) for r2 in r2s):
+        for i in active:
+            if r1.sEnd <= bounds[i][0]: continue
+            for r2 in output[i]:
+                if not is_fusion_compatible(r1, r2, max_fusion_point_dist, allow_extra_5_exons):
+                    break
+            else: # compatible with every record in the group
                 output[i].append(r1)
+                bounds[i][0] = max(bounds[i][0], r1.sStart)
+                bounds[i][1] = min(bounds[i][1], r1.sEnd)
                 merged = True
                 break
         if not merged:
+            active.append(len(output))
             output.append([r1])
+            bounds.append([r1.sStart, r1.sEnd])
     return output
 
 def iter_gmap_sam_for_fusion(gmap_sam_filename, fusion_candidates, transfrag_len_dict):
     """
     Iterate through a sorted GMAP SAM file
-    Continuously yield a group of overlapping records {'+': [r1, r2, ...], '-': [r3, r4....]}
+    Continuously yield a group of overlapping records ([r1, r2, ...], [r3, r4....]) as (plus, minus)
     """
+    fusion_candidates = set(fusion_candidates)
     records = []
-    iter = BioReaders.GMAPSAMReader(gmap_sam_filename, True, query_len_dict=transfrag_len_dict)
-    for r in iter:
-        if r.qID in fusion_candidates: 
-            records = [r]
-            break
-
-    for r in iter:
-        if len(records) >= 1 and r.sStart < records[-1].sStart:
+    cur_sID, cur_sStart, cur_sEnd = None, None, None
+    for r in BioReaders.GMAPSAMReader(gmap_sam_filename, True, query_len_dict=transfrag_len_dict):
+        if r.qID not in fusion_candidates: continue
+        sID, sStart, sEnd = r.sID, r.sStart, r.sEnd
+        if sID == cur_sID and sStart < cur_sStart:
             print >> sys.stderr, "SAM file is NOT sorted. ABORT!"
             sys.exit(-1)
-        if len(records) >= 1 and (r.sID != records[0].sID or r.sStart > records[-1].sEnd):
-            yield(sep_by_strand(records))
+        if sID != cur_sID or sStart > cur_sEnd:
+            if len(records) > 0:
+                yield(sep_by_strand(records))
             records = []
-        if r.qID in fusion_candidates:
-            records.append(r)
+            cur_sID, cur_sEnd = sID, sEnd
+        else:
+            cur_sEnd = max(cur_sEnd, sEnd)
+        cur_sStart = sStart
+        r._strand = r.flag.strand
+        fusion_compat_info(r) # cache segment endpoints once, at parse time
+        records.append(r)
 
     if len(records) > 0:
         yield(sep_by_strand(records))
@@ -132,88 +175,138 @@ def find_fusion_candidates(sam_filename, query_len_dict, min_locus_coverage=.1,
     (3) total coverage is >= 99%
     (4) distance between the loci is at least 100kb
     """
-    TmpRec = namedtuple('TmpRec', ['qCov', 'qLen', 'qStart', 'qEnd', 'sStart', 'sEnd'])
-    def total_coverage(tmprecs):
-        tree = ClusterTree(0, 0)
-        for r in tmprecs: tree.insert(r.qStart, r.qEnd, -1)
-        return sum(reg[1]-reg[0] for reg in tree.getregions())
+    def total_coverage_np(loci):
+        # same union as total_coverage, with the sort and running max done in numpy
+        qs = np.fromiter((x[0] for x in loci), dtype=np.int64, count=len(loci))
+        qe = np.fromiter((x[1] for x in loci), dtype=np.int64, count=len(loci))
+        order = np.argsort(qs, kind='mergesort')
+        qs, qe = qs[order], qe[order]
+        ends = np.maximum.accumulate(qe)
+        is_new = np.empty(len(qs), dtype=bool)
+        is_new[0] = True
+        is_new[1:] = qs[1:] > ends[:-1]
+        first_i = np.flatnonzero(is_new)
+        last_i = np.r_[first_i[1:]-1, len(qs)-1]
+        return int((ends[last_i] - qs[first_i]).sum())
+
+    def total_coverage(loci):
+        # sort-sweep union of the [qStart, qEnd] intervals
+        # a handful of loci is the norm, only go to numpy for the long tail
+        if len(loci) > 32: return total_coverage_np(loci)
+        loci = sorted(loci)
+        tot = 0
+        cur_s, cur_e = loci[0][0], loci[0][1]
+        for qStart, qEnd, sStart, sEnd in loci[1:]:
+            if qStart > cur_e:
+                tot += cur_e - cur_s
+                cur_s, cur_e = qStart, qEnd
+            else:
+                cur_e = max(cur_e, qEnd)
+        return tot + cur_e - cur_s
+
+    def loci_far_apart(loci):
+        # once sorted by sStart, checking adjacent loci is equivalent to checking all pairs
+        loci = sorted(loci, key=lambda x: x[2])
+        return all(loci[i+1][2]-loci[i][3]>=min_dist_between_loci \
+                   for i in xrange(len(loci)-1))
 
-    d = defaultdict(lambda: [])
+    # qID --> (qLen, [(qStart, qEnd, sStart, sEnd), ...])
+    # or None once any locus of qID falls below <min_locus_coverage>
+    d = {}
     reader = BioReaders.GMAPSAMReader(sam_filename, True, query_len_dict=query_len_dict)
-    for r in reader: d[r.qID].append(TmpRec(qCov=r.qCoverage, qLen=r.qLen, qStart=r.qStart, qEnd=r.qEnd, sStart=r.sStart, sEnd=r.sEnd))
+    for r in reader:
+        if r.qID in d:
+            if d[r.qID] is None: continue
+        else:
+            d[r.qID] = (r.qLen, [])
+        if r.qCoverage < min_locus_coverage:
+            d[r.qID] = None
+            continue
+        d[r.qID][1].append((r.qStart, r.qEnd, r.sStart, r.sEnd))
+
     fusion_candidates = []
     for k, data in d.iteritems():
-        if len(data) > 1 and \
-            all(a.qCov>=min_locus_coverage for a in data) and \
-            total_coverage(data)*1./data[0].qLen >= min_total_coverage and \
-            all(max(a.sStart,b.sStart)-min(a.sEnd,b.sEnd)>=min_dist_between_loci \
-                           for a,b in itertools.combinations(data, 2)):
+        if data is None: continue
+        qLen, loci = data
+        if len(loci) > 1 and \
+            total_coverage(loci)*1./qLen >= min_total_coverage and \
+            loci_far_apart(loci):
                     fusion_candidates.append(k)
     return fusion_candidates
 
+class FusionGroupCollector(object):
+    """
+    Stands in for the f_group file handle of BranchSimple.process_records()
+    and keeps each "PB.<gene>.<isoform>\t<ids>" line in memory, by gene,
+    since the parts of a fusion gene are written at different loci.
+    """
+    def __init__(self):
+        self.gene_order = []
+        self.gene_parts = {} # PB.<gene> --> list of member id lists, one per part
+
+    def write(self, line):
+        pbid, ids = line.rstrip('\n').split('\t')
+        gene_id = pbid[:pbid.rfind('.')]
+        if gene_id not in self.gene_parts:
+            self.gene_order.append(gene_id)
+            self.gene_parts[gene_id] = []
+        self.gene_parts[gene_id].append(ids.split(','))
+
+    def close(self):
+        pass
+
 def fusion_main(fa_or_fq_filename, sam_filename, output_prefix, is_fq=False, allow_extra_5_exons=True, skip_5_exon_alt=False, prefix_dict_pickle_filename=None):
     """
     (1) identify fusion candidates (based on mapping, total coverage, identity, etc)
-    (2) group/merge the fusion exons, using an index to point to each individual part
-    (3) use BranchSimple to write out a tmp GFF where 
+    (2) group/merge the fusion exons, keeping only a (gene index, isoform index) counter per qID
+    (3) use BranchSimple to write out each merged group to the GFF right away, where
          PBfusion.1.1 is the first part of a fusion gene
          PBfusion.1.2 is the second part of a fusion gene
-    (4) read the tmp file from <3> and modify it so that 
+        and collect the group output in memory
+    (4) use the collected groups from <3> so that
          PBfusion.1 just represents the fusion gene (a single transcript GFF format)
     """
-    compressed_records_pointer_dict = defaultdict(lambda: [])
-    merged_exons = []
-    merged_i = 0
-    
-    # step (0). check for duplicate IDs
-    check_ids_unique(fa_or_fq_filename, is_fq=is_fq)
-
     # step (1). identify fusion candidates
+    #           (BranchSimple also checks for duplicate IDs while reading the input)
     bs = branch_simple2.BranchSimple(fa_or_fq_filename, is_fq=is_fq)
     fusion_candidates = find_fusion_candidates(sam_filename, bs.transfrag_len_dict)
 
     # step (2). merge the fusion exons
+    # step (3). use BranchSimple to write each merged group as soon as it is done
+    #           qID --> [gene_index, next isoform_index], gene_index is in order of first appearance
+    fusion_index = {}
+    # GFF is written a line at a time, use a large buffer to cut down on write calls
+    f_good = open(output_prefix + '.gff', 'w', OUTPUT_BUFFER_SIZE)
+    f_group = FusionGroupCollector()
+    f_bad = f_good
     for recs in iter_gmap_sam_for_fusion(sam_filename, fusion_candidates, bs.transfrag_len_dict):
-        for v in recs.itervalues():
+        for v in recs:
             if len(v) > 0:
                 o = merge_fusion_exons(v, max_fusion_point_dist=100, allow_extra_5_exons=allow_extra_5_exons)
                 for group in o:
-                    merged_exons.append(group)
-                    for r in group: compressed_records_pointer_dict[r.qID].append(merged_i)
-                    merged_i += 1
-
-    # step (3). use BranchSimple to write a temporary file
-    f_good = open(output_prefix + '.gff', 'w')
-    f_group = open('branch_tmp.group.txt', 'w')
-    f_bad = f_good
-    gene_index = 1
-    for qid,indices in compressed_records_pointer_dict.iteritems():
-        for isoform_index,i in enumerate(indices):
-            bs.cuff_index = gene_index # for set to the same
-            records = merged_exons[i]
-            bs.process_records(records, allow_extra_5_exons, skip_5_exon_alt, \
-                    f_good, f_bad, f_group, tolerate_end=100, \
-                    starting_isoform_index=isoform_index, gene_prefix='PBfusion')
-        gene_index += 1
+                    for r in group:
+                        if r.qID not in fusion_index:
+                            fusion_index[r.qID] = [len(fusion_index)+1, 0]
+                        gene_index, isoform_index = fusion_index[r.qID]
+                        bs.cuff_index = gene_index # for set to the same
+                        bs.process_records(group, allow_extra_5_exons, skip_5_exon_alt, \
+                                f_good, f_bad, f_group, tolerate_end=100, \
+                                starting_isoform_index=isoform_index, gene_prefix='PBfusion')
+                        fusion_index[r.qID][1] += 1
     f_good.close()
     f_bad.close()
     f_group.close()
 
-    # step (4). read the tmp file and modify to display per fusion gene
-    f_group = open(output_prefix + '.group.txt', 'w')
+    # step (4). modify the collected groups to display per fusion gene
+    groups = f_group
+    f_group = open(output_prefix + '.group.txt', 'w', OUTPUT_BUFFER_SIZE)
     count = 0
-    with open('branch_tmp.group.txt') as f:
-        while True:
-            line = f.readline().strip()
-            if len(line) == 0: break
-            pbid1, groups1 = line.strip().split('\t')
-            pbid2, groups2 = f.readline().strip().split('\t')
-            assert pbid1.split('.')[1] == pbid2.split('.')[1]
-            group = set(groups1.split(',')).intersection(groups2.split(','))
-            f_group.write("{0}\t{1}\n".format(pbid1[:pbid1.rfind('.')], ",".join(group)))
-            count += 1
+    for gene_id in groups.gene_order:
+        parts = groups.gene_parts[gene_id]
+        group = set(parts[0]).intersection(*parts[1:])
+        f_group.write("{0}\t{1}\n".format(gene_id, ",".join(group)))
+        count += 1
     f_group.close()
-    os.remove('branch_tmp.group.txt')
 
     print >> sys.stderr, "{0} fusion candidates identified.".format(count)
     print >> sys.stderr, "Output written to: {0}.gff, {0}.group.txt".format(output_prefix)
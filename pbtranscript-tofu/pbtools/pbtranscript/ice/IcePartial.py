@@ -48,20 +48,44 @@ to an output pickle file.
 
 import os
 import os.path as op
+import hashlib
 import logging
+import subprocess
+import tempfile
 import time
-from cPickle import dump
+from collections import defaultdict
+from cPickle import dump, HIGHEST_PROTOCOL
 from pbcore.io import FastaReader
-from pbcore.util.Process import backticks
 from pbtools.pbtranscript.Utils import realpath, touch, real_upath
 from pbtools.pbtranscript.PBTranscriptOptions import add_fofn_arguments
 from pbtools.pbtranscript.ice.ProbModel import ProbFromModel, ProbFromQV, ProbFromFastq
 from pbtools.pbtranscript.ice.IceUtils import blasr_against_ref
 from pbtools.pbtranscript.ice.IceUtils import ice_fa2fq
 
+def blasr_cache_key(input_fasta, ref_fasta, cmd):
+    """Return a key identifying a blasr run by the sizes and mtimes
+    of input_fasta and ref_fasta and the blasr command line."""
+    return hashlib.sha256("{0}|{1}|{2}|{3}|{4}".format(
+        op.getsize(input_fasta), op.getmtime(input_fasta),
+        op.getsize(ref_fasta), op.getmtime(ref_fasta), cmd)).hexdigest()
+
+
+def _wait_for_blasr(proc, blasr_log, cmd):
+    """Wait for the blasr process, raise RuntimeError if it failed."""
+    _code = proc.wait()
+    blasr_log.seek(0)
+    _msg = blasr_log.read()
+    blasr_log.close()
+    if _code != 0:
+        errMsg = "Command failed: {cmd}\n{e}".format(cmd=cmd, e=_msg)
+        logging.error(errMsg)
+        raise RuntimeError(errMsg)
+
+
 def build_uc_from_partial(input_fasta, ref_fasta, out_pickle,
                           sa_file=None, ccs_fofn=None,
-                          done_filename=None, blasr_nproc=12, use_finer_qv=False):
+                          done_filename=None, blasr_nproc=12, use_finer_qv=False,
+                          reuse_blasr=False):
     """
     Given an input_fasta file of non-full-length (partial) reads and
     (unpolished) consensus isoforms sequences in ref_fasta, align reads to
@@ -75,76 +99,122 @@ def build_uc_from_partial(input_fasta, ref_fasta, out_pickle,
     ccs_fofn --- If None, assume no quality value is available,
     otherwise, use QV from ccs_fofn.
     blasr_nproc --- equivalent to blasr -nproc, number of CPUs to use
+    reuse_blasr --- If True, keep blasr output in <input_fasta>.blasr
+    (with its key in <input_fasta>.blasr.key), and skip blasr if the
+    output of an identical earlier run is there. Otherwise, parse blasr
+    output directly from its stdout.
     """
     input_fasta = realpath(input_fasta)
     m5_file = input_fasta + ".blasr"
+    m5_key_file = m5_file + ".key"
     out_pickle = realpath(out_pickle)
     if sa_file is None:
         if op.exists(input_fasta + ".sa"):
             sa_file = input_fasta + ".sa"
 
+    # blasr -m 5 output is parsed straight from its stdout unless reused
     cmd = "blasr {i} ".format(i=real_upath(input_fasta)) + \
           "{r} -bestn 5 ".format(r=real_upath(ref_fasta)) + \
           "-nproc {n} -m 5 ".format(n=blasr_nproc) + \
-          "-maxScore -1000 -minPctIdentity 85 " + \
-          "-out {o} ".format(o=real_upath(m5_file))
+          "-maxScore -1000 -minPctIdentity 85 "
+    if reuse_blasr:
+        cmd += "-out {o} ".format(o=real_upath(m5_file))
+    else:
+        cmd += "-out /dev/stdout "
     if sa_file is not None and op.exists(sa_file):
         cmd += "-sa {sa}".format(sa=real_upath(sa_file))
 
-    logging.info("CMD: {cmd}".format(cmd=cmd))
-    _out, _code, _msg = backticks(cmd)
-    if _code != 0:
-        errMsg = "Command failed: {cmd}\n{e}".format(cmd=cmd, e=_msg)
-        logging.error(errMsg)
-        raise RuntimeError(errMsg)
-    
-    if ccs_fofn is None:
-        logging.info("Loading probability from model (0.01,0.07,0.06)")
-        probqv = ProbFromModel(.01, .07, .06)
-    else:
-        start_t = time.time()
-        if use_finer_qv:
-            logging.info("Loading QVs from {i} + {f} took {s} secs".format(f=ccs_fofn, i=input_fasta,\
-                    s=time.time()-start_t))
-            probqv = ProbFromQV(input_fofn=ccs_fofn, fasta_filename=input_fasta)
+    run_blasr = True
+    if reuse_blasr:
+        blasr_key = blasr_cache_key(input_fasta, ref_fasta, cmd)
+        old_key = None
+        if op.exists(m5_file) and op.exists(m5_key_file):
+            with open(m5_key_file) as f:
+                old_key = f.read().strip()
+        if old_key == blasr_key:
+            logging.info("Reusing blasr output {f}.".format(f=m5_file))
+            run_blasr = False
+        elif op.exists(m5_key_file):
+            # m5_file is about to be overwritten
+            os.remove(m5_key_file)
+
+    # QVs do not depend on blasr output, so load them while blasr is running.
+    proc, blasr_log = None, None
+    if run_blasr:
+        logging.info("CMD: {cmd}".format(cmd=cmd))
+        blasr_log = tempfile.TemporaryFile()
+        if reuse_blasr:
+            proc = subprocess.Popen(cmd, shell=True, stdout=blasr_log,
+                                    stderr=subprocess.STDOUT)
         else:
-            input_fastq = input_fasta[:input_fasta.rfind('.')] + '.fastq'
-            logging.info("Converting {i} + {f} --> {fq}".format(i=input_fasta, f=ccs_fofn, fq=input_fastq))
-            ice_fa2fq(input_fasta, ccs_fofn, input_fastq)
-            logging.info("Loading QVs from {fq} took {s} secs".format(fq=input_fastq, s=time.time()-start_t))
-            probqv = ProbFromFastq(input_fastq)
+            proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                    stderr=blasr_log, bufsize=1 << 20)
+    try:
+        if ccs_fofn is None:
+            logging.info("Loading probability from model (0.01,0.07,0.06)")
+            probqv = ProbFromModel(.01, .07, .06)
+        else:
+            start_t = time.time()
+            if use_finer_qv:
+                probqv = ProbFromQV(input_fofn=ccs_fofn, fasta_filename=input_fasta)
+                logging.info("Loading QVs from {i} + {f} took {s} secs".format(f=ccs_fofn, i=input_fasta,\
+                        s=time.time()-start_t))
+            else:
+                input_fastq = op.splitext(input_fasta)[0] + '.fastq'
+                logging.info("Converting {i} + {f} --> {fq}".format(i=input_fasta, f=ccs_fofn, fq=input_fastq))
+                ice_fa2fq(input_fasta, ccs_fofn, input_fastq)
+                probqv = ProbFromFastq(input_fastq)
+                logging.info("Loading QVs from {fq} took {s} secs".format(fq=input_fastq, s=time.time()-start_t))
 
+        if reuse_blasr and proc is not None:
+            _wait_for_blasr(proc, blasr_log, cmd)
+            proc = None
+            with open(m5_key_file, 'w') as f:
+                f.write(blasr_key + "\n")
 
-    logging.info("Calling blasr_against_ref ...")
-    hitItems = blasr_against_ref(output_filename=m5_file,
-                                 is_FL=False,
-                                 sID_starts_with_c=True,
-                                 qver_get_func=probqv.get_smoothed,
-                                 ece_penalty=1,
-                                 ece_min_len=10,
-                                 same_strand_only=False)
+        logging.info("Calling blasr_against_ref ...")
+        hitItems = blasr_against_ref(output_filename=m5_file if reuse_blasr else proc.stdout,
+                                     is_FL=False,
+                                     sID_starts_with_c=True,
+                                     qver_get_func=probqv.get_smoothed,
+                                     ece_penalty=1,
+                                     ece_min_len=10,
+                                     same_strand_only=False)
 
-    partial_uc = {}  # Maps each isoform (cluster) id to a list of reads
-    # which can map to the isoform
-    seen = set()  # reads seen
-    logging.info("Building uc from BLASR hits.")
-    for h in hitItems:
-        if h.ece_arr is not None:
-            if h.cID not in partial_uc:
-                partial_uc[h.cID] = []
-            partial_uc[h.cID].append(h.qID)
-            seen.add(h.qID)
+        partial_uc = defaultdict(list)  # Maps each isoform (cluster) id to a list of reads
+        # which can map to the isoform
+        seen = set()  # reads seen
+        logging.info("Building uc from BLASR hits.")
+        for h in hitItems:
+            if h.ece_arr is not None:
+                partial_uc[h.cID].append(h.qID)
+                seen.add(h.qID)
+        partial_uc = dict(partial_uc)
+    except:
+        if proc is not None:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            blasr_log.close()
+        raise
 
-    allhits = set(r.name.split()[0] for r in FastaReader(input_fasta))
+    if proc is not None:
+        _wait_for_blasr(proc, blasr_log, cmd)
 
     logging.info("Counting reads with no hit.")
-    nohit = allhits.difference(seen)
+    nohit = set()
+    for r in FastaReader(input_fasta):
+        rid = r.name.split(None, 1)[0]
+        if rid not in seen:
+            nohit.add(rid)
 
+    # Dump to a tmp file and rename it, so that out_pickle is never
+    # seen half written before done_filename is created.
     logging.info("Dumping uc to a pickle: {f}.".format(f=out_pickle))
-    with open(out_pickle, 'w') as f:
-        dump({'partial_uc': partial_uc, 'nohit': nohit}, f)
-
-    os.remove(m5_file)
+    tmp_pickle = out_pickle + '.tmp'
+    with open(tmp_pickle, 'wb') as f:
+        dump({'partial_uc': partial_uc, 'nohit': nohit}, f, HIGHEST_PROTOCOL)
+    os.rename(tmp_pickle, out_pickle)
 
     done_filename = realpath(done_filename) if done_filename is not None \
         else out_pickle + '.DONE'
@@ -162,7 +232,8 @@ class IcePartialOne(object):
 
     def __init__(self, input_fasta, ref_fasta, out_pickle,
                  sa_file=None, ccs_fofn=None,
-                 done_filename=None, blasr_nproc=12, use_finer_qv=False):
+                 done_filename=None, blasr_nproc=12, use_finer_qv=False,
+                 reuse_blasr=False):
         self.input_fasta = input_fasta
         self.ref_fasta = ref_fasta
         self.out_pickle = out_pickle
@@ -171,6 +242,7 @@ class IcePartialOne(object):
         self.done_filename = done_filename
         self.blasr_nproc = blasr_nproc
         self.use_finer_qv = use_finer_qv
+        self.reuse_blasr = reuse_blasr
 
     def cmd_str(self):
         """Return a cmd string (ice_partial.py one)."""
@@ -180,11 +252,12 @@ class IcePartialOne(object):
                              sa_file=self.sa_file,
                              ccs_fofn=self.ccs_fofn,
                              done_filename=self.done_filename,
-                             blasr_nproc=self.blasr_nproc)
+                             blasr_nproc=self.blasr_nproc,
+                             reuse_blasr=self.reuse_blasr)
 
     def _cmd_str(self, input_fasta, ref_fasta, out_pickle,
                  sa_file=None, ccs_fofn=None,
-                 done_filename=None, blasr_nproc=12):
+                 done_filename=None, blasr_nproc=12, reuse_blasr=False):
         """Return a cmd string (ice_partil.py one)"""
         cmd = self.prog + \
               "{f} ".format(f=input_fasta) + \
@@ -198,6 +271,8 @@ class IcePartialOne(object):
             cmd += "--done {d} ".format(d=done_filename)
         if blasr_nproc is not None:
             cmd += "--blasr_nproc {b} ".format(b=blasr_nproc)
+        if reuse_blasr:
+            cmd += "--reuse_blasr "
         return cmd
 
     def run(self):
@@ -209,7 +284,8 @@ class IcePartialOne(object):
                               sa_file=self.sa_file,
                               ccs_fofn=self.ccs_fofn,
                               blasr_nproc=self.blasr_nproc,
-                              use_finer_qv=self.use_finer_qv)
+                              use_finer_qv=self.use_finer_qv,
+                              reuse_blasr=self.reuse_blasr)
 
 
 def add_ice_partial_one_arguments(parser):
@@ -231,6 +307,10 @@ def add_ice_partial_one_arguments(parser):
                         help="blasr -nproc, number of CPUs [default: 12]")
     parser.add_argument("--use_finer_qv", action="store_true", default=False,
                         help="Use finer QV which uses more memory & time [default: False]")
+    parser.add_argument("--reuse_blasr", action="store_true", default=False,
+                        help="Keep blasr output next to input_fasta and reuse it " +
+                             "when input_fasta, ref_fasta and the blasr command " +
+                             "are unchanged [default: False]")
     return parser
 
 
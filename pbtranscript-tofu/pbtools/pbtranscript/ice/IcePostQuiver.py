@@ -178,7 +178,7 @@ class IcePostQuiver(IceFiles):
             if sum(q[self.qv_trim_5: -self.qv_trim_3]) <= self.qv_max_err:
                 good.append(cid)
 
-        partial_uc = load(open(self.nfl_all_pickle_fn))['partial_uc']
+        partial_uc = load(open(self.nfl_all_pickle_fn, 'rb'))['partial_uc']
         partial_uc2 = defaultdict(lambda: [])
         partial_uc2.update(partial_uc)
 
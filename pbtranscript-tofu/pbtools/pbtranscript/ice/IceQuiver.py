@@ -426,7 +426,7 @@ class IceQuiver(IceFiles):
 
         self.add_log("Loading partial uc from {f}.".
                      format(f=self.nfl_all_pickle_fn))
-        partial_uc = load(open(self.nfl_all_pickle_fn))['partial_uc']
+        partial_uc = load(open(self.nfl_all_pickle_fn, 'rb'))['partial_uc']
         partial_uc2 = defaultdict(lambda: [])
         partial_uc2.update(partial_uc)
         return (uc, partial_uc2, refs)
@@ -332,7 +332,7 @@ class IceQuiverPostprocess(IceFiles):
                 if 1.0 - (err_sum / float(qv_len)) >= self.hq_quiver_min_accuracy:
                     good.append(cid)
 
-        partial_uc = load(open(self.nfl_all_pickle_fn))['partial_uc']
+        partial_uc = load(open(self.nfl_all_pickle_fn, 'rb'))['partial_uc']
         partial_uc2 = defaultdict(lambda: [])
         partial_uc2.update(partial_uc)
 
@@ -7,7 +7,7 @@ import filecmp
 import random
 import numpy as np
 from multiprocessing import Process, Manager
-from cPickle import dump, load
+from cPickle import dump, load, HIGHEST_PROTOCOL
 from collections import defaultdict
 from pbcore.util.Process import backticks
 from pbcore.io import FastaReader, FastaWriter, FastqWriter, \
@@ -187,6 +187,8 @@ def blasr_against_ref(output_filename, is_FL, sID_starts_with_c,
     qver_get_func --- should be basQV.basQVcacher.get() or
                       .get_smoothed(), or can just pass in
                       lambda (x, y): 1. to ignore QV
+    output_filename --- blasr -m 5 output file, or an open file
+                      object such as the stdout of a running blasr
     """
     with BLASRM5Reader(output_filename) as reader:
         for r in reader:
@@ -607,7 +609,7 @@ def combine_nfl_pickles(splitted_pickles, out_pickle):
         nohit = set()
         for pf in splitted_pickles:
             logging.debug("Merging {pf}.".format(pf=pf))
-            a = load(open(pf))
+            a = load(open(pf, 'rb'))
             nohit.update(a['nohit'])
             for k, v in a['partial_uc'].iteritems():
                 partial_uc[k] += v
@@ -615,8 +617,8 @@ def combine_nfl_pickles(splitted_pickles, out_pickle):
         logging.debug("Dumping all to {f}".format(f=out_pickle))
         # Dump to one file
         partial_uc = dict(partial_uc)
-        with open(out_pickle, 'w') as f:
-            dump({'nohit': nohit, 'partial_uc': partial_uc}, f)
+        with open(out_pickle, 'wb') as f:
+            dump({'nohit': nohit, 'partial_uc': partial_uc}, f, HIGHEST_PROTOCOL)
         logging.debug("{f} created.".format(f=out_pickle))
 
 def cid_with_annotation(cid):
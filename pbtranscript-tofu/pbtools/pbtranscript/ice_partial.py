@@ -178,7 +178,8 @@ class IcePartialRunner(PBMultiToolRunner):
                                     ccs_fofn=args.ccs_fofn,
                                     done_filename=args.done_filename,
                                     blasr_nproc=args.blasr_nproc,
-                                    use_finer_qv=args.use_finer_qv)
+                                    use_finer_qv=args.use_finer_qv,
+                                    reuse_blasr=args.reuse_blasr)
             elif cmd == "split":
                 obj = IcePartialSplit(root_dir=args.root_dir,
                                       nfl_fa=args.nfl_fa,
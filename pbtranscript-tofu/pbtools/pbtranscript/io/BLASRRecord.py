@@ -210,11 +210,18 @@ class BLASRRecord(object):
 
 class BLASRReaderBase(object):
 
-    """BLASR M4, M5 Reader Base."""
+    """BLASR M4, M5 Reader Base.
+    fileName can also be an open file object, e.g., the stdout
+    pipe of a running blasr process.
+    """
 
     def __init__(self, fileName, className="BLASRReaderBase"):
-        self.fileName = fileName
         self.className = className
+        if hasattr(fileName, 'read'):
+            self.fileName = str(getattr(fileName, 'name', fileName))
+            self.infile = fileName
+            return
+        self.fileName = fileName
         try:
             self.infile = open(self.fileName, 'r')
         except IOError as e:
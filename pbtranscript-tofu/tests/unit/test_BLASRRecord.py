@@ -127,3 +127,12 @@ class TEST_BLASRRECORD(unittest.TestCase):
         self.assertTrue(r2 == self.t22)
 
 
+
+    def test_M5Reader_file_object(self):
+        """Test BLASR M5 Reader reading from an open file object."""
+        with open(self.m5, 'r') as f:
+            reads_from_obj = [x for x in BLASRM5Reader(f)]
+        reads = [x for x in BLASRM5Reader(self.m5)]
+        self.assertEqual(len(reads_from_obj), len(reads))
+        for r0, r1 in zip(reads_from_obj, reads):
+            self.assertTrue(r0 == r1)